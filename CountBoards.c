@@ -0,0 +1,250 @@
+/*
+ * The board search of Enumeration.py, in C.
+ * See Enumeration.py for the board coordinates, the spiral,
+ * and what makes a board layout valid.
+ *
+ * Build it next to Enumeration.py with:
+ *     gcc -O3 -shared -fPIC -o libCountBoards.so CountBoards.c
+ * Enumeration.py loads libCountBoards.so through ctypes when it exists.
+ *
+ * See LICENSE for the program's license.
+ */
+
+#include <stdint.h>
+
+/* Representation of directions, as in Enumeration.py */
+#define NOWHERE -1
+#define NORTH 0
+#define EAST 1
+#define WEST 2
+#define SOUTH 3
+
+/* Sides of a piece, in the order of NEIGHBORS[] in Enumeration.py */
+#define NW 0
+#define SW 1
+#define SE 2
+#define NE 3
+
+/* The most pieces a board can have. */
+#define MAX_PIECES 25
+
+/*
+ * The spiral index standing for a place off the board.
+ * It's never occupied, so it reads as NOWHERE.
+ */
+#define OFF_BOARD MAX_PIECES
+
+/*
+ * The board being enumerated, indexed by spiral index:
+ * 2 bits of direction per piece in board,
+ * and 1 bit per piece in occupied, which is clear for NOWHERE.
+ */
+static uint64_t board;
+static uint32_t occupied;
+
+static int spiralLength;
+
+/* neighbor[k][side] = the spiral index of the neighbor of spiral[k]. */
+static int neighbor[MAX_PIECES][4];
+
+/*
+ * loopPiece[k][direction][turn] = the spiral indexes of the other three
+ * pieces of the counterclockwise (turn 0) and clockwise (turn 1) loops
+ * a piece at spiral[k] pointing in direction can be part of:
+ * a neighbor, the far (diagonal) corner, then the other neighbor.
+ * See LOOPS[] in Enumeration.py.
+ */
+static int loopPiece[MAX_PIECES][4][2][3];
+
+/* outie[direction][side] = 1 if a piece pointing that way has an 'outie' there. */
+static const unsigned char outie[4][4] = {
+    /* NORTH */ {0, 1, 1, 0},
+    /* EAST  */ {1, 1, 0, 0},
+    /* WEST  */ {0, 0, 1, 1},
+    /* SOUTH */ {1, 0, 0, 1}
+};
+
+/*
+ * loopDirection[myDirection][turn] = the directions of loopPiece[][][turn]
+ * that close a loop with a piece pointing myDirection.
+ * See LOOP_CCW[] and LOOP_CW[] in Enumeration.py.
+ */
+static const int loopDirection[4][2][3] = {
+    /* NORTH */ {{WEST, SOUTH, EAST}, {EAST, SOUTH, WEST}},
+    /* EAST  */ {{NORTH, WEST, SOUTH}, {SOUTH, WEST, NORTH}},
+    /* WEST  */ {{SOUTH, EAST, NORTH}, {NORTH, EAST, SOUTH}},
+    /* SOUTH */ {{EAST, NORTH, WEST}, {WEST, NORTH, EAST}}
+};
+
+/*
+ * overlaps[side] = bit (myDirection * 4 + otherDirection) is set
+ * where a piece and its neighbor on that side overlap.
+ * Filled in from outie[] by count_valid().
+ */
+static uint32_t overlaps[4];
+
+/* Return the direction of the piece at spiral index k, or NOWHERE. */
+static int directionAt(int k) {
+    if (!(occupied >> k & 1)) {
+        return NOWHERE;
+    }
+    return (int) (board >> (2 * k) & 3);
+}
+
+/*
+ * Return 1 if the piece at spiral index k can legally be pointing
+ * its direction, 0 otherwise. The C version of isPieceDirectionLegal().
+ */
+static int isLegal(int k) {
+    int myDirection = directionAt(k);
+    int side;
+    int turn;
+
+    for (side = NW; side <= NE; ++side) {
+        int otherDirection = directionAt(neighbor[k][side]);
+        if (otherDirection != NOWHERE
+                && (overlaps[side] >> (myDirection * 4 + otherDirection) & 1)) {
+            return 0;
+        }
+    }
+
+    for (turn = 0; turn < 2; ++turn) {
+        const int *pieces = loopPiece[k][myDirection][turn];
+        const int *directions = loopDirection[myDirection][turn];
+        if (directionAt(pieces[0]) == directions[0]
+                && directionAt(pieces[1]) == directions[1]
+                && directionAt(pieces[2]) == directions[2]) {
+            return 0;
+        }
+    }
+
+    return 1;
+}
+
+/*
+ * Place the piece at spiral index k in all four directions,
+ * recursing to place the rest of the spiral.
+ * Return the number of valid boards found.
+ */
+static uint64_t placePiece(int k) {
+    uint64_t found = 0;
+    uint64_t d;
+
+    if (k >= spiralLength) {
+        return 1;
+    }
+
+    occupied |= (uint32_t) 1 << k;
+    for (d = NORTH; d <= SOUTH; ++d) {
+        board = (board & ~((uint64_t) 3 << (2 * k))) | (d << (2 * k));
+        if (isLegal(k)) {
+            found += placePiece(k + 1);
+        }
+    }
+
+    /* Remove this piece from the board. */
+    occupied &= ~((uint32_t) 1 << k);
+    board &= ~((uint64_t) 3 << (2 * k));
+    return found;
+}
+
+/*
+ * Count the valid boards.
+ * spiralX[] and spiralY[] are the coordinates of the spiral,
+ * length pieces long; see spiral[] in Enumeration.py.
+ * initialDirection[k] is the direction of spiral[k] for k < firstSpiralIndex
+ * (NOWHERE for an empty place); the pieces from firstSpiralIndex on are
+ * enumerated.
+ * Returns 0 if there are more than MAX_PIECES pieces.
+ */
+uint64_t count_valid(int length, const int *spiralX, const int *spiralY,
+        const int *initialDirection, int firstSpiralIndex) {
+    /* spiralAt[x + 4][y + 4] = spiral index of [x, y], or OFF_BOARD */
+    int spiralAt[9][9];
+    int k;
+    int x;
+    int y;
+    int side;
+
+    if (length > MAX_PIECES) {
+        return 0;
+    }
+    spiralLength = length;
+
+    for (x = 0; x < 9; ++x) {
+        for (y = 0; y < 9; ++y) {
+            spiralAt[x][y] = OFF_BOARD;
+        }
+    }
+    for (k = 0; k < length; ++k) {
+        spiralAt[spiralX[k] + 4][spiralY[k] + 4] = k;
+    }
+
+    for (k = 0; k < length; ++k) {
+        /* Offsets by 4 so the array indexes are positive. */
+        int cx = spiralX[k] + 4;
+        int cy = spiralY[k] + 4;
+        int nw = spiralAt[cx - 1][cy];
+        int sw = spiralAt[cx][cy - 1];
+        int se = spiralAt[cx + 1][cy];
+        int ne = spiralAt[cx][cy + 1];
+
+        neighbor[k][NW] = nw;
+        neighbor[k][SW] = sw;
+        neighbor[k][SE] = se;
+        neighbor[k][NE] = ne;
+
+        loopPiece[k][NORTH][0][0] = nw;
+        loopPiece[k][NORTH][0][1] = spiralAt[cx - 1][cy - 1];
+        loopPiece[k][NORTH][0][2] = sw;
+        loopPiece[k][NORTH][1][0] = ne;
+        loopPiece[k][NORTH][1][1] = spiralAt[cx + 1][cy + 1];
+        loopPiece[k][NORTH][1][2] = se;
+
+        loopPiece[k][EAST][0][0] = ne;
+        loopPiece[k][EAST][0][1] = spiralAt[cx - 1][cy + 1];
+        loopPiece[k][EAST][0][2] = nw;
+        loopPiece[k][EAST][1][0] = se;
+        loopPiece[k][EAST][1][1] = spiralAt[cx + 1][cy - 1];
+        loopPiece[k][EAST][1][2] = sw;
+
+        loopPiece[k][SOUTH][0][0] = se;
+        loopPiece[k][SOUTH][0][1] = spiralAt[cx + 1][cy + 1];
+        loopPiece[k][SOUTH][0][2] = ne;
+        loopPiece[k][SOUTH][1][0] = sw;
+        loopPiece[k][SOUTH][1][1] = spiralAt[cx - 1][cy - 1];
+        loopPiece[k][SOUTH][1][2] = nw;
+
+        loopPiece[k][WEST][0][0] = sw;
+        loopPiece[k][WEST][0][1] = spiralAt[cx + 1][cy - 1];
+        loopPiece[k][WEST][0][2] = se;
+        loopPiece[k][WEST][1][0] = nw;
+        loopPiece[k][WEST][1][1] = spiralAt[cx - 1][cy + 1];
+        loopPiece[k][WEST][1][2] = ne;
+    }
+
+    /* Overlap: my 'outie' on this side meets the other's on the opposite side. */
+    for (side = NW; side <= NE; ++side) {
+        int my;
+        int other;
+        overlaps[side] = 0;
+        for (my = NORTH; my <= SOUTH; ++my) {
+            for (other = NORTH; other <= SOUTH; ++other) {
+                if (outie[my][side] && outie[other][(side + 2) % 4]) {
+                    overlaps[side] |= (uint32_t) 1 << (my * 4 + other);
+                }
+            }
+        }
+    }
+
+    board = 0;
+    occupied = 0;
+    for (k = 0; k < firstSpiralIndex && k < length; ++k) {
+        if (initialDirection[k] != NOWHERE) {
+            occupied |= (uint32_t) 1 << k;
+            board |= (uint64_t) initialDirection[k] << (2 * k);
+        }
+    }
+
+    return placePiece(firstSpiralIndex);
+}
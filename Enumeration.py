@@ -18,6 +18,11 @@
 # non-looping board layouts,
 # calculated in about 18 hours on a 2017 Dell laptop
 # with 16GB of ram and a 2.8GHz Intel Core i7.
+# (It now takes well under a minute.)
+#
+# Usage: python Enumeration.py [--profile] [--search {python,c,numba}]
+# --profile runs the enumeration under cProfile.
+# --search chooses how the boards are counted; see countBoards().
 # 
 # Clearly it's not feasible to record all those positions,
 # let alone calculate and record all the valid moves between them.
@@ -33,10 +38,36 @@
 # That is, abs(x) + abs(y) <= 3.
 
 import sys
+import os
+import ctypes
+import multiprocessing
+import queue
+import time
+import traceback
+import argparse
 import cProfile
 
-# The number of valid board layouts found so far.
-validBoards = 0
+# If the C version of the search, CountBoards.c, has been built
+# into libCountBoards.so next to this file, countBoards() can use it.
+# See CountBoards.c for how to build it.
+try:
+    countBoardsLibrary = ctypes.CDLL(os.path.join(
+        os.path.dirname(os.path.abspath(__file__)), "libCountBoards.so"))
+    countBoardsLibrary.count_valid.restype = ctypes.c_uint64
+except OSError:
+    countBoardsLibrary = None
+
+# If Numba and numpy are installed, countBoards() can use
+# the compiled walk(), below.
+try:
+    import numpy as np
+    from numba import njit
+except ImportError:
+    np = None
+
+    # Leave the functions to be compiled as plain Python. They're not called.
+    def njit(*args, **kwargs):
+        return lambda function: function
 
 # Representation of directions
 NOWHERE = -1    # pointing in no direction (no piece at these coordinates).
@@ -48,28 +79,42 @@ SOUTH = 3
 # The directions to attempt placing each piece in.
 directions = [NORTH, EAST, WEST, SOUTH]
 
+# The directions to attempt placing spiral[1] in.
+# The other two are its mirror images; see walkBoards().
+# That holds only while the center, spiral[0], is left empty.
+mirrorDirections = [NORTH, EAST]
+
 # The worksheet for enumerating board positions.
 # Indexed by indexOfCoord(x, y),
 # holds the current direction of the piece at those coordinates.
 # NOWHERE means there is no piece at those coordinates.
 # Coordinates representing a place outside the board
 # are set to NOWHERE.
-pieceDirection = [
-    NOWHERE, NOWHERE, NOWHERE, NOWHERE, NOWHERE, NOWHERE, NOWHERE
-    ,NOWHERE, NOWHERE, NOWHERE, NOWHERE, NOWHERE, NOWHERE, NOWHERE
-    ,NOWHERE, NOWHERE, NOWHERE, NOWHERE, NOWHERE, NOWHERE, NOWHERE
-    ,NOWHERE, NOWHERE, NOWHERE, NOWHERE, NOWHERE, NOWHERE, NOWHERE
-    ,NOWHERE, NOWHERE, NOWHERE, NOWHERE, NOWHERE, NOWHERE, NOWHERE
-    ,NOWHERE, NOWHERE, NOWHERE, NOWHERE, NOWHERE, NOWHERE, NOWHERE
-    ,NOWHERE, NOWHERE, NOWHERE, NOWHERE, NOWHERE, NOWHERE, NOWHERE
-    ]
+#
+# The worksheet is a 9 x 9 grid (x and y from -4 through 4)
+# rather than 7 x 7 so that every neighbor and diagonal of a board position
+# has its own index: with a 7-wide grid, [-1, 4] would share
+# an index with [0, -3].
+#
+# It stays a list: reading a list element is faster than reading
+# an array.array() element, which makes a new int object each time.
+# (A full run of placePiece(1) took 24 seconds with array.array("b")
+# vs. 15 seconds with a list.)
+# Copies kept or sent to other processes are packed; see packBoard().
+pieceDirection = [NOWHERE] * (9 * 9)
 
 # Given the coordinates of a board position,
 # return the pieceDirection[] index
 # of the direction of the piece at those coordinates.
 def indexOfCoord(x, y):
     # Changes the values to strictly positive numbers.
-    return (x + 3) * 7 + (y + 3);
+    return (x + 4) * 9 + (y + 4);
+
+# ON_BOARD[indexOfCoord(x, y)] is 1 if the given coordinate is on the board,
+# 0 otherwise.
+# Built once, so the hot path does a byte lookup instead of calling isOnBoard().
+ON_BOARD = bytes(1 if abs(x) + abs(y) <= 3 else 0
+                 for x in range(-4, 4 + 1) for y in range(-4, 4 + 1))
 
 # Returns True if the given coordinate is on the board,
 # False otherwise.
@@ -105,15 +150,94 @@ def isOnBoard(x, y):
 ##
 ##    return distance < (3 + 1)
     
-    # 30 seconds for <= 16 spiral steps.
-    if x < 0:
-        if y < 0:
-            return -x - y <= 3
-        return y - x <= 3
-    # x >= 0
-    if y < 0:
-        return x - y <= 3
-    return x + y <= 3
+##    # 30 seconds for <= 16 spiral steps.
+##    if x < 0:
+##        if y < 0:
+##            return -x - y <= 3
+##        return y - x <= 3
+##    # x >= 0
+##    if y < 0:
+##        return x - y <= 3
+##    return x + y <= 3
+
+    # isPieceDirectionLegal() no longer calls this function;
+    # it looks up ON_BOARD[] directly.
+    return ON_BOARD[indexOfCoord(x, y)] == 1
+
+# Neighbor tables, indexed by indexOfCoord(x, y) of a board position.
+# Coordinates off the board refer to worksheet padding
+# that is always NOWHERE, so isPieceDirectionLegal() can read
+# its neighbors without first asking whether they are on the board.
+#
+# NEIGHBORS[i] = the indexes of the pieces to the
+# Northwest, Southwest, Southeast, and Northeast of the piece at i.
+#
+# LOOPS[i][direction] = the indexes of the other three pieces of the
+# counterclockwise and of the clockwise loop a piece at i pointing
+# in that direction can be part of: a neighbor, the far (diagonal) corner,
+# then the other neighbor. See Loops.jpg.
+NEIGHBORS = [None] * (9 * 9)
+LOOPS = [None] * (9 * 9)
+for x in range(-3, 3 + 1):
+    for y in range(-3, 3 + 1):
+        if isOnBoard(x, y):
+            i = indexOfCoord(x, y)
+            nw = indexOfCoord(x - 1, y)
+            sw = indexOfCoord(x, y - 1)
+            se = indexOfCoord(x + 1, y)
+            ne = indexOfCoord(x, y + 1)
+            NEIGHBORS[i] = (nw, sw, se, ne)
+            LOOPS[i] = [None] * 4
+            LOOPS[i][NORTH] = ((nw, indexOfCoord(x - 1, y - 1), sw),
+                               (ne, indexOfCoord(x + 1, y + 1), se))
+            LOOPS[i][EAST] = ((ne, indexOfCoord(x - 1, y + 1), nw),
+                              (se, indexOfCoord(x + 1, y - 1), sw))
+            LOOPS[i][SOUTH] = ((se, indexOfCoord(x + 1, y + 1), ne),
+                               (sw, indexOfCoord(x - 1, y - 1), nw))
+            LOOPS[i][WEST] = ((sw, indexOfCoord(x + 1, y - 1), se),
+                              (nw, indexOfCoord(x - 1, y + 1), ne))
+
+# Return a table of whether a piece overlaps its neighbor on one side.
+# The table is indexed by (myDirection + 1) * 5 + (otherDirection + 1),
+# (+ 1 so NOWHERE fits) and is 1 where the two pieces overlap:
+# where I point in one of myOuties and the other piece points in one of
+# otherOuties, giving us both an 'outie' on our shared side.
+def overlapTable(myOuties, otherOuties):
+    return bytes(1 if myDirection in myOuties and otherDirection in otherOuties else 0
+                 for myDirection in range(NOWHERE, SOUTH + 1)
+                 for otherDirection in range(NOWHERE, SOUTH + 1))
+
+# Overlap with the piece to the Northwest: my 'outie' to the NW, its to the SE.
+OVERLAP_NW = overlapTable((SOUTH, EAST), (NORTH, WEST))
+# ...the piece to the SouthWest: my 'outie' to the SW, its to the NE.
+OVERLAP_SW = overlapTable((NORTH, EAST), (SOUTH, WEST))
+# ...the piece to the SouthEast: my 'outie' to the SE, its to the NW.
+OVERLAP_SE = overlapTable((NORTH, WEST), (SOUTH, EAST))
+# ...the piece to the NorthEast: my 'outie' to the NE, its to the SW.
+OVERLAP_NE = overlapTable((SOUTH, WEST), (NORTH, EAST))
+
+# Return a table of whether three pieces complete a loop with mine.
+# The table is indexed by
+# (aDirection + 1) * 25 + (farDirection + 1) * 5 + (bDirection + 1)
+# for the directions of the loop's pieces listed in LOOPS[],
+# and is 1 only where they point the given directions.
+def loopTable(aDirection, farDirection, bDirection):
+    table = bytearray(5 * 5 * 5)
+    table[(aDirection + 1) * 25 + (farDirection + 1) * 5 + (bDirection + 1)] = 1
+    return bytes(table)
+
+# LOOP_CCW[myDirection] and LOOP_CW[myDirection] = the loop tables
+# for the counterclockwise and clockwise loops of LOOPS[i][myDirection].
+LOOP_CCW = [None] * 4
+LOOP_CW = [None] * 4
+LOOP_CCW[NORTH] = loopTable(WEST, SOUTH, EAST)
+LOOP_CW[NORTH] = loopTable(EAST, SOUTH, WEST)
+LOOP_CCW[EAST] = loopTable(NORTH, WEST, SOUTH)
+LOOP_CW[EAST] = loopTable(SOUTH, WEST, NORTH)
+LOOP_CCW[SOUTH] = loopTable(EAST, NORTH, WEST)
+LOOP_CW[SOUTH] = loopTable(WEST, NORTH, EAST)
+LOOP_CCW[WEST] = loopTable(SOUTH, EAST, NORTH)
+LOOP_CW[WEST] = loopTable(NORTH, EAST, SOUTH)
 
 # (debug) Print the current configuration of the board
 def printBoard():
@@ -162,6 +286,57 @@ spiral = [
     ,[0, -3]
 ]
 
+# DEBUG to profile a version that eventually finishes:
+# shorten the spiral, so the search places only its first pieces.
+# Everything below, including placePieceSteps[] and the C and Numba
+# searches, follows len(spiral). (The mirror symmetry walkBoards() relies on
+# holds only for whole rings, so for other lengths count with placePiece(1), times 4.)
+# I added this because I believed the code would take
+# over a century to run. It turns out it takes less than a day.
+# [:16] takes 173 seconds and produces 11,460,096 boards.
+# [:18] takes 678 seconds (~11 minutes) and produces 31,532,544 boards.
+# [:19] takes 1256 seconds (20 minutes) and produces 82,990,848 boards.
+# A full run took 65285 seconds (18 hours) and produced 3,625,093,120 boards.
+##spiral = spiral[:16]
+
+# spiralPieceIndex[n] = the pieceDirection[] index of spiral[n].
+spiralPieceIndex = [indexOfCoord(xy[0], xy[1]) for xy in spiral]
+
+# Return pieceDirection[] packed into one int, 3 bits per spiral place:
+# bits 3 * k through 3 * k + 2 hold the direction of spiral[k] + 1,
+# so NOWHERE is 0 and an empty board is 0.
+# A packed board is much quicker to hash and to pickle than a list.
+def packBoard():
+    global spiral
+    global spiralPieceIndex
+    global pieceDirection
+
+    board = 0
+    for k in range(len(spiral)):
+        board |= (pieceDirection[spiralPieceIndex[k]] + 1) << (3 * k)
+    return board
+
+# Set the spiral places of pieceDirection[] from a packBoard() board.
+def unpackBoard(board):
+    global spiral
+    global spiralPieceIndex
+    global pieceDirection
+
+    for k in range(len(spiral)):
+        pieceDirection[spiralPieceIndex[k]] = (board >> (3 * k) & 7) - 1
+
+# frontierMask[k] = the bits of a packBoard() board holding
+# the pieces before spiral[k] that are next to or diagonal to
+# spiral[k] or a later piece.
+# Just those pieces decide which ways spiral[k] on can be placed:
+# isPieceDirectionLegal() reads only a piece's neighbors and
+# the far corners of its loops.
+frontierMask = [sum(7 << (3 * j) for j in range(k)
+                    if any(abs(spiral[j][0] - spiral[later][0]) <= 1
+                           and abs(spiral[j][1] - spiral[later][1]) <= 1
+                           for later in range(k, len(spiral))))
+                for k in range(len(spiral) + 1)]
+
 # (debug) Print the pieceDirection[] index
 # corresponding to each coordinate.
 # A test of indexOfCoord().
@@ -177,232 +352,579 @@ def debugPrintSpiral():
     for xy in spiral:
         print("x = ", xy[0], " y = ", xy[1])
 
-# Record the fact that we've found a valid board position.
-# That is, a board configuration where all coordinates are occupied by pieces
-# and no parts of pieces overlap or form loops.
-def recordValidBoard():
-    global validBoards
-    
-    validBoards += 1
-
-    # Print occasionally, to let us know the program is making progress.
-    if validBoards % 100000 == 0:
-        print(validBoards // 1000, "K");
-
 # Return True if the given piece can legally be pointing in this direction,
 # False otherwise.
 # There are two illegal conditions:
 # 1) This piece overlaps a neighbor, or
 # 2) This piece forms a loop of mutual dependency (a locked loop).
 #
-# The piece at [myX, myY] must have been placed (is not NOWHERE)
+# myIndex is the pieceDirection[] index of the piece, as from indexOfCoord().
+# The piece there must have been placed (is not NOWHERE)
 # and is on the board.
-def isPieceDirectionLegal(myX, myY):
-    global pieceDirection
-    global NOWHERE
-    global NORTH
-    global SOUTH
-    global EAST
-    global WEST
+#
+# The other arguments are never passed. Their defaults bind the globals
+# this function reads to local variables, which are faster to read.
+def isPieceDirectionLegal(myIndex, pieceDirection=pieceDirection,
+                          NEIGHBORS=NEIGHBORS, LOOPS=LOOPS,
+                          OVERLAP_NW=OVERLAP_NW, OVERLAP_SW=OVERLAP_SW,
+                          OVERLAP_SE=OVERLAP_SE, OVERLAP_NE=OVERLAP_NE,
+                          LOOP_CCW=LOOP_CCW, LOOP_CW=LOOP_CW):
+    # Pieces that are off the board read as NOWHERE (see NEIGHBORS),
+    # which matches none of the directions tested below.
+    nwIndex, swIndex, seIndex, neIndex = NEIGHBORS[myIndex]
 
-    # important because directions of pieces that are off the board
-    # don't get set below, but are needed for loop detection.
-    nwDirection = NOWHERE # direction of the piece to my Northwest
-    swDirection = NOWHERE # ...Southwest
-    seDirection = NOWHERE # ...Southeast
-    neDirection = NOWHERE # ...Northeast
-    
-    myDirection = pieceDirection[indexOfCoord(myX, myY)];
+    myDirection = pieceDirection[myIndex];
+    # The OVERLAP_* row of my direction, + 1 for the other's NOWHERE.
+    myRow = (myDirection + 1) * 5 + 1
 
     # Check overlap with the piece to the Northwest
-    otherX = myX - 1
-    otherY = myY
-    if isOnBoard(otherX, otherY): # piece is on the board
-        nwDirection = pieceDirection[indexOfCoord(otherX, otherY)]
-        otherDirection = nwDirection
-        # overlaps if we have an 'outie' to the NW and other has an 'outie' to the SE.
-        if (myDirection == SOUTH or myDirection == EAST) and \
-           (otherDirection == NORTH or otherDirection == WEST):
-            return False
+    nwDirection = pieceDirection[nwIndex]
+    if OVERLAP_NW[myRow + nwDirection]:
+        return False
 
     # ...the piece to the SouthWest
-    otherX = myX
-    otherY = myY -1
-    if isOnBoard(otherX, otherY): # piece is on the board
-        swDirection = pieceDirection[indexOfCoord(otherX, otherY)]
-        otherDirection = swDirection
-        # overlaps if we have an 'outie' to the SW and other has an 'outie' to the NE.
-        if (myDirection == NORTH or myDirection == EAST) and \
-           (otherDirection == SOUTH or otherDirection == WEST):
-            return False
+    swDirection = pieceDirection[swIndex]
+    if OVERLAP_SW[myRow + swDirection]:
+        return False
 
     # ...the piece to the SouthEast
-    otherX = myX + 1
-    otherY = myY
-    if isOnBoard(otherX, otherY): # piece is on the board
-        seDirection = pieceDirection[indexOfCoord(otherX, otherY)]
-        otherDirection = seDirection
-        # overlaps if we have an 'outie' to the SE and other has an 'outie' to the NW.
-        if (myDirection == NORTH or myDirection == WEST) and \
-           (otherDirection == SOUTH or otherDirection == EAST):
-            return False
+    seDirection = pieceDirection[seIndex]
+    if OVERLAP_SE[myRow + seDirection]:
+        return False
 
     # ...the piece to the NorthEast
-    otherX = myX
-    otherY = myY + 1
-    if isOnBoard(otherX, otherY): # piece is on the board
-        neDirection = pieceDirection[indexOfCoord(otherX, otherY)]
-        otherDirection = neDirection
-        # overlaps if we have an 'outie' to the NE and other has an 'outie' to the SW.
-        if (myDirection == SOUTH or myDirection == WEST) and \
-           (otherDirection == NORTH or otherDirection == EAST):
-            return False
+    neDirection = pieceDirection[neIndex]
+    if OVERLAP_NE[myRow + neDirection]:
+        return False
 
     # Nothing overlaps with the passed piece.
     
-    # Check for loops
-    
-    if myDirection == NORTH:
-        
-        # See if we are in a counterclockwise loop.
-        farX = myX - 1
-        farY = myY - 1
-        if isOnBoard(farX, farY): # the far coordinate is in the board
-            farDirection = pieceDirection[indexOfCoord(farX, farY)]
-            if nwDirection == WEST and farDirection == SOUTH \
-               and swDirection == EAST:
-                return False
-
-        # See if we are in a clockwise loop.
-        farX = myX + 1
-        farY = myY + 1
-        if isOnBoard(farX, farY): # the far coordinate is in the board
-            farDirection = pieceDirection[indexOfCoord(farX, farY)]
-            if neDirection == EAST and farDirection == SOUTH \
-               and seDirection == WEST:
-                return False
-
-    elif myDirection == EAST:
-        
-        # See if we are in a counterclockwise loop.
-        farX = myX - 1
-        farY = myY + 1
-        if isOnBoard(farX, farY): # the far coordinate is in the board
-            farDirection = pieceDirection[indexOfCoord(farX, farY)]
-            if neDirection == NORTH and farDirection == WEST \
-               and nwDirection == SOUTH:
-                return False
-
-        # See if we are in a clockwise loop.
-        farX = myX + 1
-        farY = myY - 1
-        if isOnBoard(farX, farY): # the far coordinate is in the board
-            farDirection = pieceDirection[indexOfCoord(farX, farY)]
-            if seDirection == SOUTH and farDirection == WEST \
-               and swDirection == NORTH:
-                return False
- 
-    elif myDirection == SOUTH:
-        
-        # See if we are in a counterclockwise loop.
-        farX = myX + 1
-        farY = myY + 1
-        if isOnBoard(farX, farY): # the far coordinate is in the board
-            farDirection = pieceDirection[indexOfCoord(farX, farY)]
-            if seDirection == EAST and farDirection == NORTH \
-               and neDirection == WEST:
-                return False
-
-        # See if we are in a clockwise loop.
-        farX = myX - 1
-        farY = myY - 1
-        if isOnBoard(farX, farY): # the far coordinate is in the board
-            farDirection = pieceDirection[indexOfCoord(farX, farY)]
-            if swDirection == WEST and farDirection == NORTH \
-               and nwDirection == EAST:
-                return False
-
-    elif myDirection == WEST:
-        
-        # See if we are in a counterclockwise loop.
-        farX = myX + 1
-        farY = myY - 1
-        if isOnBoard(farX, farY): # the far coordinate is in the board
-            farDirection = pieceDirection[indexOfCoord(farX, farY)]
-            if swDirection == SOUTH and farDirection == EAST \
-               and seDirection == NORTH:
-                return False
-
-        # See if we are in a clockwise loop.
-        farX = myX - 1
-        farY = myY + 1
-        if isOnBoard(farX, farY): # the far coordinate is in the board
-            farDirection = pieceDirection[indexOfCoord(farX, farY)]
-            if nwDirection == NORTH and farDirection == EAST \
-               and neDirection == SOUTH:
-                return False
-
-        
+    # Check for loops.
+    # Which pieces make up the two loops I can be in depends on my direction.
+    ccw, cw = LOOPS[myIndex][myDirection]
+
+    # See if we are in a counterclockwise loop.
+    if LOOP_CCW[myDirection][(pieceDirection[ccw[0]] + 1) * 25
+                             + (pieceDirection[ccw[1]] + 1) * 5
+                             + pieceDirection[ccw[2]] + 1]:
+        return False
+
+    # See if we are in a clockwise loop.
+    if LOOP_CW[myDirection][(pieceDirection[cw[0]] + 1) * 25
+                            + (pieceDirection[cw[1]] + 1) * 5
+                            + pieceDirection[cw[2]] + 1]:
+        return False
+
     # This piece is not part of a loop either.
     return True
 
+# Return the rules isPieceDirectionLegal() applies to a piece
+# pointing in myDirection, read from the OVERLAP_* and LOOP_* tables:
+# overlaps[side] = the directions that overlap my neighbor NEIGHBORS[i][side],
+# and closing[turn] = the directions of the pieces of LOOPS[i][myDirection][turn]
+# that close that loop.
+# stepSource(), below, writes its legality tests from these,
+# so the tables stay the one statement of the rules.
+def directionRules(myDirection):
+    overlaps = []
+    for table in (OVERLAP_NW, OVERLAP_SW, OVERLAP_SE, OVERLAP_NE):
+        overlaps.append(tuple(otherDirection for otherDirection in range(NORTH, SOUTH + 1)
+                              if table[(myDirection + 1) * 5 + (otherDirection + 1)]))
+
+    closing = []
+    for tables in (LOOP_CCW, LOOP_CW):
+        i = tables[myDirection].index(1)
+        closing.append((i // 25 - 1, i // 5 % 5 - 1, i % 5 - 1))
+    return overlaps, closing
+
+# subtreeCounts[key] = the number of valid boards placePiece() has found
+# that follow from a board, where key is the board's frontierMask[] bits
+# for the spiral index, with the spiral index in the low 5 bits.
+# Many different ways of placing the first pieces leave the same frontier,
+# so placePiece() counts the boards that follow from each only once.
+subtreeCounts = {}
+
+# The first spiral index whose counts are kept in subtreeCounts[].
+# Before it, nearly every frontier is unique, so keeping them costs memory
+# without saving time. For a full, single-process run of placePiece(1):
+# from 0: 17.6 seconds, 3,033,745 counts kept, 427MB.
+# from 15: 13.9 seconds, 1,894,076 counts, 212MB.
+# from 17: 15.0 seconds, 238,076 counts, 34MB.
+# from 18: 25.2 seconds, 124,316 counts, 23MB.
+MEMO_SPIRAL_INDEX = 17
+
+# placePieceSteps[k](board) = placePiece(k, board), written out for spiral[k].
+#
+# Where spiral[k] is and which pieces are around it never change,
+# so stepSource() writes a function for each spiral index with
+# the pieceDirection[] indexes, the legality tests of
+# isPieceDirectionLegal() for each direction (see directionRules()),
+# and the board bits all as constants, and each function calls
+# the next index's function directly.
+# Knowing the direction, most of the tests drop out:
+# a NORTH piece, for example, has no 'outie' to the NW or NE,
+# so it can't overlap its neighbors there and isn't checked.
+# The tests also leave out any piece the spiral hasn't reached yet,
+# or that is off the board: it's always NOWHERE, so it can neither
+# overlap nor close a loop.
+# This takes a full, single-process run of placePiece(1)
+# from about 9 seconds to about 3.
+#
+# For example, placePieceSteps[2] is:
+#   def placePiece2(board, pieceDirection=pieceDirection,
+#                   subtreeCounts=subtreeCounts, placeNext=placePiece3):
+#       found = 0
+#       pieceDirection[41] = 0
+#       if pieceDirection[40] not in (2, 3):
+#           found += placeNext(board | 64)
+#       ...
+#       pieceDirection[41] = 3
+#       found += placeNext(board | 256)
+#       pieceDirection[41] = -1
+#       return found
+
+# Return the source of placePieceSteps[spiralIndex], named placePiece<spiralIndex>.
+# The function for spiralIndex + 1 must already exist in stepNamespace.
+def stepSource(spiralIndex):
+    pieceIndex = spiralPieceIndex[spiralIndex]
+    shift = 3 * spiralIndex
+    # The places that may hold a piece when spiral[spiralIndex] is placed.
+    placed = set(spiralPieceIndex[:spiralIndex])
+    lastStep = spiralIndex == len(spiral) - 1
+    memo = spiralIndex >= MEMO_SPIRAL_INDEX
+
+    lines = ["def placePiece%d(board, pieceDirection=pieceDirection,"
+             " subtreeCounts=subtreeCounts%s):"
+             % (spiralIndex, "" if lastStep else
+                ", placeNext=placePiece%d" % (spiralIndex + 1))]
+    if memo:
+        lines.append("    key = (board & %d) << 5 | %d"
+                     % (frontierMask[spiralIndex], spiralIndex))
+        lines.append("    found = subtreeCounts.get(key)")
+        lines.append("    if found is not None:")
+        lines.append("        return found")
+    lines.append("    found = 0")
+
+    for myDirection in directions:
+        overlaps, closing = directionRules(myDirection)
+        tests = []
+        for neighbor, others in zip(NEIGHBORS[pieceIndex], overlaps):
+            if others and neighbor in placed:
+                tests.append("pieceDirection[%d] not in %r" % (neighbor, others))
+        for loop, loopDirections in zip(LOOPS[pieceIndex][myDirection], closing):
+            if all(i in placed for i in loop):
+                tests.append("not (pieceDirection[%d] == %d and pieceDirection[%d] == %d"
+                             " and pieceDirection[%d] == %d)"
+                             % (loop[0], loopDirections[0], loop[1], loopDirections[1],
+                                loop[2], loopDirections[2]))
+
+        lines.append("    pieceDirection[%d] = %d" % (pieceIndex, myDirection))
+        indent = "    "
+        if tests:
+            lines.append("    if " + " and ".join(tests) + ":")
+            indent = "        "
+        if lastStep:
+            lines.append(indent + "found += 1")
+        else:
+            lines.append(indent + "found += placeNext(board | %d)"
+                         % ((myDirection + 1) << shift))
+
+    lines.append("    pieceDirection[%d] = %d" % (pieceIndex, NOWHERE))
+    if memo:
+        lines.append("    subtreeCounts[key] = found")
+    lines.append("    return found")
+    return "\n".join(lines) + "\n"
+
+# Written from the end of the spiral back, so each step's next exists.
+# The steps are defined in stepNamespace rather than in the module,
+# which holds just what they read.
+stepNamespace = {"pieceDirection": pieceDirection, "subtreeCounts": subtreeCounts}
+placePieceSteps = [None] * len(spiral)
+for k in range(len(spiral) - 1, -1, -1):
+    exec(stepSource(k), stepNamespace)
+    placePieceSteps[k] = stepNamespace["placePiece%d" % k]
+
 # Place the piece from the given index in the spiral.
 # Attempt to place the piece in all four directions,
 # recursing for each direction to walk the entire spiral.
-def placePiece(spiralIndex):
+# Return the number of valid boards found.
+# board is pieceDirection[] as packed by packBoard().
+#
+# The work is done by placePieceSteps[]; pieceDirection[]
+# must be NOWHERE from spiral[spiralIndex] on.
+#
+# The recursion is never more than len(spiral) (25) calls deep,
+# far below Python's default limit, so there's no sys.setrecursionlimit().
+# It's deliberately recursion rather than a loop over an explicit stack
+# of (spiralIndex, next direction) frames, as walk() does for Numba:
+# in CPython 3.11 a full, single-process run of placePiece(1)
+# took 18 seconds with an explicit stack, against 3.9 seconds for
+# placePieceSteps[], whose calls are cheap and whose tests are constants.
+def placePiece(spiralIndex, board):
+    # If we've reached the end of the spiral
+    # We should have filled the board, and have a valid board.
+    if spiralIndex > len(spiral) - 1:
+        return 1
+
+    return placePieceSteps[spiralIndex](board)
+
+# The compiled search.
+# walk() does the same job as placePiece(), but as a loop over
+# an explicit stack instead of recursion, reading the board tables
+# as arguments instead of globals, so that Numba can compile it.
+# Its arguments are numpy copies of the tables; see compiledTables().
+
+# Return True if the piece at myIndex can legally be pointing its direction,
+# False otherwise. The compiled version of isPieceDirectionLegal().
+@njit(cache=True)
+def isLegalCompiled(pieceDirection, myIndex, neighbors, overlaps, loops, loopTables):
+    myDirection = pieceDirection[myIndex]
+    myRow = (myDirection + 1) * 5 + 1
+
+    # Check overlap with the pieces to the NW, SW, SE, and NE.
+    for side in range(4):
+        if overlaps[side, myRow + pieceDirection[neighbors[myIndex, side]]]:
+            return False
+
+    # Check for counterclockwise (0) and clockwise (1) loops.
+    for turn in range(2):
+        pieces = loops[myIndex, myDirection, turn]
+        if loopTables[turn, myDirection,
+                      (pieceDirection[pieces[0]] + 1) * 25
+                      + (pieceDirection[pieces[1]] + 1) * 5
+                      + pieceDirection[pieces[2]] + 1]:
+            return False
+
+    return True
+
+# Place the pieces from spiral[firstSpiralIndex] on,
+# in all directions, and return the number of valid boards found.
+# pieceDirection is modified while walking, and restored on return.
+@njit(cache=True)
+def walk(pieceDirection, firstSpiralIndex, spiralPieceIndex,
+         neighbors, overlaps, loops, loopTables):
+    spiralLength = len(spiralPieceIndex)
+    if firstSpiralIndex >= spiralLength:
+        return 1
+
+    found = 0
+
+    # nextDirection[k] = index into directions of the next direction
+    # to try for spiral[k]; 4 means all have been tried.
+    nextDirection = np.zeros(spiralLength, np.int8)
+    spiralIndex = firstSpiralIndex
+    while spiralIndex >= firstSpiralIndex:
+        pieceIndex = spiralPieceIndex[spiralIndex]
+        d = nextDirection[spiralIndex]
+        if d == 4:
+            # Remove this piece from the board; back up to the previous one.
+            pieceDirection[pieceIndex] = NOWHERE
+            spiralIndex -= 1
+            continue
+        nextDirection[spiralIndex] = d + 1
+
+        pieceDirection[pieceIndex] = d
+        if isLegalCompiled(pieceDirection, pieceIndex,
+                           neighbors, overlaps, loops, loopTables):
+            if spiralIndex == spiralLength - 1:
+                found += 1
+            else:
+                # Leave this piece here and place the following pieces.
+                spiralIndex += 1
+                nextDirection[spiralIndex] = 0
+
+    return found
+
+# Return the board tables as the numpy arrays walk() takes:
+# (spiralPieceIndex, neighbors, overlaps, loops, loopTables).
+def compiledTables():
+    overlaps = np.array([list(OVERLAP_NW), list(OVERLAP_SW),
+                         list(OVERLAP_SE), list(OVERLAP_NE)], np.uint8)
+
+    # Placeholder rows for positions off the board; walk() never reads them.
+    neighbors = np.zeros((9 * 9, 4), np.int32)
+    loops = np.zeros((9 * 9, 4, 2, 3), np.int32)
+    for i in range(9 * 9):
+        if NEIGHBORS[i] is not None:
+            neighbors[i] = NEIGHBORS[i]
+            loops[i] = LOOPS[i]
+
+    loopTables = np.array([[list(LOOP_CCW[d]) for d in range(4)],
+                           [list(LOOP_CW[d]) for d in range(4)]], np.uint8)
+
+    return (np.array(spiralPieceIndex, np.int32),
+            neighbors, overlaps, loops, loopTables)
+
+# Return the number of valid boards found by placing the pieces
+# from spiral[firstSpiralIndex] on, using the C search in countBoardsLibrary.
+# The pieces before firstSpiralIndex are as in pieceDirection[].
+def countBoardsInC(firstSpiralIndex):
+    global spiral
+    global spiralPieceIndex
+    global pieceDirection
+
+    IntArray = ctypes.c_int * len(spiral)
+    return countBoardsLibrary.count_valid(
+        len(spiral),
+        IntArray(*[xy[0] for xy in spiral]),
+        IntArray(*[xy[1] for xy in spiral]),
+        IntArray(*[pieceDirection[i] for i in spiralPieceIndex]),
+        firstSpiralIndex)
+
+# The search countBoards() uses:
+# "python" = placePiece(), which counts the boards that follow from
+#     each frontier only once. The fastest, and the default.
+# "c" = the C search in libCountBoards.so, if it has been built.
+# "numba" = the compiled walk(), if Numba and numpy are installed.
+# The C and Numba searches visit every board.
+search = "python"
+
+# Return the number of valid boards found by placing the pieces
+# from spiral[firstSpiralIndex] on, using the chosen search.
+# The pieces before firstSpiralIndex are as in pieceDirection[].
+def countBoards(firstSpiralIndex):
+    global pieceDirection
+    global search
+
+    if search == "c" and countBoardsLibrary is not None:
+        return countBoardsInC(firstSpiralIndex)
+    if search == "numba" and np is not None:
+        board = np.array(pieceDirection, np.int8)
+        return walk(board, firstSpiralIndex, *compiledTables())
+
+    return placePiece(firstSpiralIndex, packBoard())
+
+# The number of spiral places filled in by walkBoards() itself.
+# Each legal way of placing the pieces before spiral[WORK_SPIRAL_INDEX]
+# becomes one piece of work for the worker processes.
+WORK_SPIRAL_INDEX = 6
+
+# The last spiral index at which a worker process will give away
+# part of its search to other workers.
+# Past it, the worker hands the rest of its search to countBoards().
+SHARE_SPIRAL_INDEX = 10
+
+# How many seconds a worker process waits between looking at
+# the tasks queue to see whether others need work.
+# tasks.qsize() is a round trip to the Manager process, about 25
+# microseconds; asking at every chance, some 54,000 times a run,
+# cost more than a second of a 3 second single-process run.
+SHARE_CHECK_SECONDS = 0.05
+
+# (worker process) The time.monotonic() at which countSharing()
+# next looks at the tasks queue.
+nextShareCheck = 0.0
+
+# Append to work[] a (WORK_SPIRAL_INDEX, packBoard(), 0) task
+# for each legal way of placing the pieces from spiral[spiralIndex]
+# up to spiral[WORK_SPIRAL_INDEX].
+# Like placePiece(), but stops early and records instead of counting.
+def collectWork(spiralIndex, work):
     global spiral
+    global spiralPieceIndex
     global pieceDirection
     global directions
+    global mirrorDirections
     global NOWHERE
 
-    # DEBUG to profile a version that eventually finishes.
-    # I added this code because I believed the code would take
-    # over a century to run. It turns out it takes less than a day.
-    # >=16 takes 173 seconds and produces 11,460,096 boards.
-    # >= 18 takes 678 seconds (~11 minutes) and produces 31,532,544 boards.
-    # >= 19 takes 1256 seconds (20 minutes) and produces 82,990,848 boards.
-    # A full run took 65285 seconds (18 hours) and produced 3,625,093,120 boards.
-##    if spiralIndex >= 16:
-##        recordValidBoard()
-##        return
-
-    # If we've reached the end of the spiral
-    # We should have filled the board, and have a valid board.
-    if spiralIndex > len(spiral) - 1:
-        recordValidBoard()
+    if spiralIndex >= WORK_SPIRAL_INDEX or spiralIndex > len(spiral) - 1:
+        work.append((spiralIndex, packBoard(), 0))
         return
 
-    coord = spiral[spiralIndex];
-    pieceIndex = indexOfCoord(coord[0], coord[1])
+    # spiral[1] is placed only in mirrorDirections; see walkBoards().
+    placeDirections = directions
+    if spiralIndex == 1:
+        placeDirections = mirrorDirections
 
-    # Try placing this piece in each of the four directions
-    for d in directions:
+    pieceIndex = spiralPieceIndex[spiralIndex]
+    for d in placeDirections:
         pieceDirection[pieceIndex] = d
-        # If this piece's direction is legal,
-        # leave this piece here and place all the following pieces.
-        if isPieceDirectionLegal(coord[0], coord[1]):
-            placePiece(spiralIndex + 1)
+        if isPieceDirectionLegal(pieceIndex):
+            collectWork(spiralIndex + 1, work)
+
+    pieceDirection[pieceIndex] = NOWHERE
+
+# (worker process) Place the piece from the given index in the spiral
+# in directions[firstDirection:], and count the valid boards that follow.
+# Like placePiece(), but whenever fewer than minTasks tasks are waiting
+# in the tasks queue (looked at every SHARE_CHECK_SECONDS),
+# the directions not yet tried are put on the queue
+# as a (spiralIndex, packBoard(), next direction) task
+# for whichever worker is free, instead of being tried here.
+# Return the number of valid boards found.
+#
+# Before giving a task away, put (0, 1) on the results queue,
+# telling walkBoards() there's one more task to wait for.
+# It must come first: the task could otherwise be finished, and its
+# result counted, before walkBoards() knew of it, letting walkBoards()
+# decide all the work was done while this worker's was still going.
+def countSharing(spiralIndex, firstDirection, tasks, results, minTasks):
+    global spiral
+    global spiralPieceIndex
+    global pieceDirection
+    global directions
+    global NOWHERE
+    global nextShareCheck
+
+    if spiralIndex > SHARE_SPIRAL_INDEX or spiralIndex > len(spiral) - 1:
+        return countBoards(spiralIndex)
+
+    found = 0
+    pieceIndex = spiralPieceIndex[spiralIndex]
+    for directionIndex in range(firstDirection, len(directions)):
+        # We've just finished a direction. Share the rest if others need work.
+        if directionIndex > firstDirection and time.monotonic() >= nextShareCheck:
+            nextShareCheck = time.monotonic() + SHARE_CHECK_SECONDS
+            if tasks.qsize() < minTasks:
+                results.put((0, 1))
+                tasks.put((spiralIndex, packBoard(), directionIndex))
+                break
+
+        pieceDirection[pieceIndex] = directions[directionIndex]
+        if isPieceDirectionLegal(pieceIndex):
+            found += countSharing(spiralIndex + 1, 0, tasks, results, minTasks)
 
-    # Remove this piece from the board. We're done with it for now.
     pieceDirection[pieceIndex] = NOWHERE
+    return found
+
+# (worker process) Take tasks from the tasks queue until it yields None.
+# For each, set up its board, then put (boards found, -1),
+# -1 for the task done, on the results queue.
+# If a task raises an exception, put (None, its traceback) instead and stop,
+# so walkBoards() reports the failure rather than waiting for the result.
+# chosenSearch is the parent's search setting, which a worker started
+# by spawning rather than forking wouldn't otherwise see.
+def countWork(tasks, results, minTasks, chosenSearch):
+    global pieceDirection
+    global search
+
+    search = chosenSearch
+    while True:
+        task = tasks.get()
+        if task is None:
+            return
+        try:
+            spiralIndex, board, firstDirection = task
+            unpackBoard(board)
+            found = countSharing(spiralIndex, firstDirection, tasks, results, minTasks)
+            results.put((found, -1))
+        except Exception:
+            results.put((None, traceback.format_exc()))
+            return
+
+# How many seconds walkBoards() waits for a result
+# before checking whether a worker process has died.
+RESULT_TIMEOUT = 10
 
 # Enumerate all valid boards
 def walkBoards():
-    global validBoards
     global pieceDirection
+    global search
     global NORTH
 
     print("Starting")
 
     # Because the whole puzzle takes days to enumerate
     # and because there is 4-fold rotational symmetry in the board layouts,
-    # Manually place the first piece, then enumerate from there.
-    # When done, multiply the result by 4 to take into account
-    # the rotationally symmetric board layouts we didn't enumerate.
+    # the first piece was meant to be placed by hand, pointing NORTH,
+    # with the result multiplied by 4 for the rotations not enumerated.
+    #
+    # NOTE: the center piece, spiral[0], is never actually placed.
+    # The line below sets pieceDirection[0], an off-board corner
+    # of the worksheet that no piece reads, not the center,
+    # pieceDirection[indexOfCoord(0, 0)] (index 40), which stays NOWHERE.
+    # So the count is of the other 24 pieces around an empty center,
+    # times 4. That's how the published 3,625,093,120 was counted.
+    #
+    # The board with an empty center is also symmetric under reflection
+    # across the line through the center and [1, 0]
+    # (the SE-NW diagonal of the board).
+    # The reflection swaps NORTH with WEST and EAST with SOUTH,
+    # so for every board with spiral[1] pointing WEST or SOUTH
+    # there is a mirror image with it pointing NORTH or EAST.
+    # So spiral[1] is placed only in mirrorDirections (see collectWork()),
+    # and the result is multiplied by 2 more, 8 in all.
+    # With spiral[1] pointing N, E, W, S there are 118,859,520,
+    # 334,277,120, 118,859,520, and 334,277,120 boards.
+    #
+    # The mirror and the * 8 depend on the center being empty:
+    # the reflection would turn a NORTH center into a WEST one.
+    # With the center really NORTH, spiral[1] NORTH has 28,463,360
+    # boards but WEST has 19,974,400, so halving gives a wrong answer.
+    # Placing the center means dropping mirrorDirections and the * 2.
+    #
+    # The symmetry also holds only if the spiral fills whole rings
+    # (1, 5, 13, or 25 places), so a run with a shortened spiral
+    # (see the DEBUG note after spiral[]) will be off.
 
+    # WARNING: index 0 is NOT the center; see the NOTE above.
+    # Don't "fix" this to indexOfCoord(0, 0) without also
+    # dropping mirrorDirections and the * 2 of the * 8.
     pieceDirection[0] = NORTH
-    placePiece(1) # Causes all valid boards to be enumerated
-    print("validBoards (* 4) =", validBoards * 4)
+
+    # Split the search by the first few pieces,
+    # and count the boards that follow from each split in parallel.
+    # Processes rather than threads, because of Python's GIL.
+    # Some splits take far longer than others, so a worker that sees
+    # the others running out of work splits its own (see countSharing()).
+    # A Manager queue, because multiprocessing.Queue.qsize()
+    # doesn't work on every platform.
+    work = []
+    collectWork(1, work)
+    print(len(work), "tasks")
+
+    processCount = multiprocessing.cpu_count()
+    with multiprocessing.Manager() as manager:
+        tasks = manager.Queue()
+        results = manager.Queue()
+        for task in work:
+            tasks.put(task)
+
+        workers = [multiprocessing.Process(target=countWork,
+                                           args=(tasks, results, 2 * processCount,
+                                                 search))
+                   for n in range(processCount)]
+        for worker in workers:
+            worker.start()
+
+        # Each result is (boards found, change in the number of tasks
+        # not yet done): -1 for a task finished, 1 for a task given away.
+        validBoards = 0
+        finished = 0
+        waiting = len(work)
+        while waiting > 0:
+            try:
+                found, change = results.get(timeout=RESULT_TIMEOUT)
+            except queue.Empty:
+                # Workers exit only when told to, below, so one that
+                # has exited died without a result (e.g. in the C library).
+                if any(worker.exitcode is not None for worker in workers):
+                    for worker in workers:
+                        worker.terminate()
+                    raise RuntimeError("a worker process died")
+                continue
+            if found is None:
+                for worker in workers:
+                    worker.terminate()
+                raise RuntimeError("a worker process failed:\n" + change)
+
+            validBoards += found
+            waiting += change
+            if change > 0:
+                continue
+
+            # Print occasionally, to let us know the program is making progress.
+            # A full run has about 200 tasks, so every 10 prints about 20 lines.
+            finished += 1
+            if finished % 10 == 0:
+                print(finished, "tasks done,", waiting, "to go")
+
+        for worker in workers:
+            tasks.put(None)
+        for worker in workers:
+            worker.join()
+
+    print("validBoards (* 8) =", validBoards * 8)
 
 # Report the output of isOnBoard() for every possible coordinate.
 def testIsOnBoard():
@@ -429,19 +951,19 @@ def testIsPieceDirectionLegal():
     pieceDirection[indexOfCoord(0, 1)] = EAST
     pieceDirection[indexOfCoord(1, 1)] = SOUTH
     pieceDirection[indexOfCoord(1, 0)] = WEST
-    if not isPieceDirectionLegal(0, 0):
+    if not isPieceDirectionLegal(indexOfCoord(0, 0)):
         print("NORTH Clockwise loop: pass")
     else:
         print("-----FAIL: NORTH Clockwise loop")
-    if not isPieceDirectionLegal(0, 1):
+    if not isPieceDirectionLegal(indexOfCoord(0, 1)):
         print("EAST Clockwise loop: pass")
     else:
         print("-----FAIL: EAST Clockwise loop")
-    if not isPieceDirectionLegal(1, 1):
+    if not isPieceDirectionLegal(indexOfCoord(1, 1)):
         print("SOUTH Clockwise loop: pass")
     else:
         print("-----FAIL: SOUTH Clockwise loop")
-    if not isPieceDirectionLegal(1, 0):
+    if not isPieceDirectionLegal(indexOfCoord(1, 0)):
         print("WEST Clockwise loop: pass")
     else:
         print("-----FAIL: WEST Clockwise loop")
@@ -457,29 +979,48 @@ def testIsPieceDirectionLegal():
     pieceDirection[indexOfCoord(-1, 0)] = WEST
     pieceDirection[indexOfCoord(-1, -1)] = SOUTH
     pieceDirection[indexOfCoord(0, -1)] = EAST
-    if not isPieceDirectionLegal(0, 0):
+    if not isPieceDirectionLegal(indexOfCoord(0, 0)):
         print("NORTH CCW loop: pass")
     else:
         print("-----FAIL: NORTH CCW loop")
-    if not isPieceDirectionLegal(-1, 0):
+    if not isPieceDirectionLegal(indexOfCoord(-1, 0)):
         print("WEST CCW loop: pass")
     else:
         print("-----FAIL: WEST CCW loop")
-    if not isPieceDirectionLegal(-1, -1):
+    if not isPieceDirectionLegal(indexOfCoord(-1, -1)):
         print("SOUTH CCW loop: pass")
     else:
         print("-----FAIL: SOUTH CCW loop")
-    if not isPieceDirectionLegal(0, -1):
+    if not isPieceDirectionLegal(indexOfCoord(0, -1)):
         print("EAST CCW loop: pass")
     else:
         print("-----FAIL: EAST CCW loop")
 
 
-# Profile the main function so we get a print of how long it took to run
-# and so that we get some hints of where the time went.
-
 # testIsPieceDirectionLegal()
 # testIsOnBoard()
-# walkBoards()
-cProfile.run('walkBoards()')
+if __name__ == "__main__":
+    # The guard keeps worker processes that import this file
+    # from starting walkBoards() themselves.
+    parser = argparse.ArgumentParser(
+        description="Enumerate the valid Ginkgo Puzzle board layouts.")
+    # Profiling prints how long the run took and hints of where the time went,
+    # but cProfile slows a call-heavy program like this one a lot,
+    # and it sees only the main process, not the workers.
+    parser.add_argument("--profile", action="store_true",
+                        help="run under cProfile (much slower)")
+    parser.add_argument("--search", choices=["python", "c", "numba"],
+                        default=search,
+                        help="which search counts the boards (default: %(default)s)")
+    args = parser.parse_args()
 
+    if args.search == "c" and countBoardsLibrary is None:
+        parser.error("libCountBoards.so isn't built; see CountBoards.c")
+    if args.search == "numba" and np is None:
+        parser.error("Numba and numpy aren't installed")
+    search = args.search
+
+    if args.profile:
+        cProfile.run('walkBoards()')
+    else:
+        walkBoards()